@@ -1,14 +1,43 @@
-from flask import Flask, redirect, render_template, flash, session, g
+from flask import (
+    Flask,
+    Response,
+    redirect,
+    render_template,
+    flash,
+    session,
+    g,
+    request,
+    stream_with_context,
+)
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
-import requests
+from werkzeug.exceptions import RequestEntityTooLarge
+import csv
 import os
 from models import db, connect_db, User, Location
 from helper import degrees_to_compass_16
-from forms import RegisterForm, LoginForm, LocationSearchForm
+from weather import get_weather_service, WeatherProviderError
+from cache import (
+    ServerSideSessionInterface,
+    get_store,
+    load_user,
+    invalidate_user,
+    regenerate_session,
+)
+from assets import init_assets
+from bulk import (
+    parse_rows,
+    lookups_needed,
+    import_favorites,
+    error_summary,
+    export_csv,
+    export_json,
+)
+from forms import RegisterForm, LoginForm, LocationSearchForm, ImportFavoritesForm
 from datetime import datetime as dt
 
 CURR_USER_KEY = "curr_user"
+WEATHER_UNAVAILABLE = "The weather service is unavailable right now. Please try again shortly."
 API_KEY = os.environ.get("API_KEY")
 
 app = Flask(__name__)
@@ -21,7 +50,44 @@ app.config["SQLALCHEMY_ECHO"] = True
 app.config["SECRET_KEY"] = os.environ.get("FLASK_KEY", "default_secret_key")
 app.config["DEBUG_TB_INTERCEPT_REDIRECTS"] = True
 
+# comma-separated, in order of preference; "fixture" (offline, fake data)
+# must be used on its own
+app.config["WEATHER_PROVIDERS"] = os.environ.get(
+    "WEATHER_PROVIDERS", "visualcrossing"
+).split(",")
+app.config["WEATHER_API_KEY"] = API_KEY
+# seconds to wait on a provider before also asking the next one
+app.config["WEATHER_HEDGE_AFTER"] = float(os.environ.get("WEATHER_HEDGE_AFTER", 1.5))
+app.config["WEATHER_TIMEOUT"] = float(os.environ.get("WEATHER_TIMEOUT", 10))
+# threads available for upstream calls (shared by requests and bulk imports)
+app.config["WEATHER_MAX_WORKERS"] = int(os.environ.get("WEATHER_MAX_WORKERS", 64))
+
+# sessions and cached users are shared between workers through Redis if set;
+# without it sessions stay in Flask's signed cookie and users are loaded per request
+app.config["REDIS_URL"] = os.environ.get("REDIS_URL")
+# seconds a cached user (email + favorite ids) is reused before reloading;
+# only with Redis, since a per-worker cache can't be invalidated by the
+# worker that changes the user's favorites
+app.config["USER_CACHE_TTL"] = (
+    int(os.environ.get("USER_CACHE_TTL", 60)) if app.config["REDIS_URL"] else 0
+)
+
+# addresses resolved in parallel during a favorites import (at most
+# WEATHER_MAX_WORKERS); imports run inside the request, so cap how many
+# addresses one upload may look up to stay within gunicorn's timeout
+app.config["IMPORT_BATCH_SIZE"] = int(os.environ.get("IMPORT_BATCH_SIZE", 50))
+app.config["IMPORT_MAX_LOOKUPS"] = int(os.environ.get("IMPORT_MAX_LOOKUPS", 1000))
+app.config["IMPORT_MAX_ROWS"] = int(os.environ.get("IMPORT_MAX_ROWS", 10000))
+# largest request body (uploads are read into memory), 2MB by default
+app.config["MAX_CONTENT_LENGTH"] = int(
+    os.environ.get("MAX_CONTENT_LENGTH", 2 * 1024 * 1024)
+)
+
+if app.config["REDIS_URL"]:
+    app.session_interface = ServerSideSessionInterface(get_store(app))
+
 connect_db(app)
+init_assets(app)
 
 debug = DebugToolbarExtension(app)
 
@@ -31,7 +97,7 @@ def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = load_user(app, session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -40,6 +106,7 @@ def add_user_to_g():
 def do_login(user):
     """Log in user."""
 
+    regenerate_session(session)
     session[CURR_USER_KEY] = user.id
 
 
@@ -47,37 +114,27 @@ def do_logout():
     """Logout user."""
 
     if CURR_USER_KEY in session:
+        invalidate_user(app, session[CURR_USER_KEY])
         del session[CURR_USER_KEY]
 
+    regenerate_session(session)
+
 
 def do_loc_search(loc_form):
-    """Perform location search."""
+    """Perform location search; return location id, or None if it failed."""
 
     location = loc_form.location.data
 
-    resp = requests.get(
-        f"https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline/{location}",
-        params={"include": "", "key": API_KEY},
-    )
-    data = resp.json()
+    try:
+        data = get_weather_service(app).resolve(location)
+    except WeatherProviderError:
+        flash(WEATHER_UNAVAILABLE, "danger")
+        return None
 
-    searched_loc = Location(
-        address=data["resolvedAddress"], lat=data["latitude"], long=data["longitude"]
+    loc_id = Location.get_or_create(
+        data["resolvedAddress"], data["latitude"], data["longitude"]
     )
-    existing_loc = Location.query.filter(
-        Location.lat == searched_loc.lat, Location.long == searched_loc.long
-    ).first()
-
-    if not existing_loc:
-        db.session.add(searched_loc)
-        db.session.commit()
-        new_loc = Location.query.filter(
-            Location.lat == searched_loc.lat, Location.long == searched_loc.long
-        ).first()
-        loc_id = new_loc.id
-
-    else:
-        loc_id = existing_loc.id
+    db.session.commit()
 
     return loc_id
 
@@ -91,7 +148,7 @@ def root():
     if loc_form.validate_on_submit():
         loc_id = do_loc_search(loc_form)
 
-        return redirect(f"/locs/{loc_id}")
+        return redirect(f"/locs/{loc_id}" if loc_id else request.path)
 
     else:
         return render_template("index.html", loc_form=loc_form, at_root=True)
@@ -107,7 +164,7 @@ def create_user():
     if loc_form.search.data and loc_form.validate():
         loc_id = do_loc_search(loc_form)
 
-        return redirect(f"/locs/{loc_id}")
+        return redirect(f"/locs/{loc_id}" if loc_id else request.path)
 
     if form.submit.data and form.validate():
         email = form.email.data
@@ -116,6 +173,7 @@ def create_user():
         try:
             new_user = User.register(email, password)
             db.session.commit()
+            invalidate_user(app, new_user.id)
 
         except IntegrityError:
             flash("A user with that email already exists.", "danger")
@@ -140,7 +198,7 @@ def login_user():
     if loc_form.search.data and loc_form.validate():
         loc_id = do_loc_search(loc_form)
 
-        return redirect(f"/locs/{loc_id}")
+        return redirect(f"/locs/{loc_id}" if loc_id else request.path)
 
     if form.submit.data and form.validate():
         email = form.email.data
@@ -181,19 +239,14 @@ def location_page(loc_id):
     if loc_form.validate_on_submit():
         loc_id = do_loc_search(loc_form)
 
-        return redirect(f"/locs/{loc_id}")
+        return redirect(f"/locs/{loc_id}" if loc_id else request.path)
 
     else:
-        resp = requests.get(
-            f"https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline/{this_loc.lat},{this_loc.long}",
-            params={
-                "unitGroup": "us",
-                "include": "days,current,alerts",
-                "key": API_KEY,
-                "contentType": "json",
-            },
-        )
-        data = resp.json()
+        try:
+            data = get_weather_service(app).forecast(this_loc.lat, this_loc.long)
+        except WeatherProviderError:
+            flash(WEATHER_UNAVAILABLE, "danger")
+            data = {}
 
         # Add readable dates
         for day in data.get("days", []):
@@ -205,7 +258,8 @@ def location_page(loc_id):
 
         current = data.get("currentConditions") or {}
         current["winddir_degrees"] = current.get("winddir")
-        current["winddir"] = degrees_to_compass_16(current.get("winddir"))
+        if current["winddir_degrees"] is not None:
+            current["winddir"] = degrees_to_compass_16(current["winddir_degrees"])
         data["num_days"] = len(data.get("days", []))
 
         loc_name = (
@@ -231,14 +285,105 @@ def update_fav(loc_id):
         return redirect(f"/locs/{loc_id}")
 
     this_loc = Location.query.get_or_404(loc_id)
+    user = User.query.get(g.user.id)
 
-    if this_loc in g.user.favorites:
-        g.user.favorites.remove(this_loc)
+    if this_loc in user.favorites:
+        user.favorites.remove(this_loc)
         flash("Removed from favorites.", "info")
     else:
-        g.user.favorites.append(this_loc)
+        user.favorites.append(this_loc)
         flash("Added to favorites.", "success")
 
     db.session.commit()
+    invalidate_user(app, user.id)
 
     return redirect(f"/locs/{loc_id}")
+
+
+@app.route("/favorites/import", methods=["GET", "POST"])
+def import_favs():
+    """Form to upload a CSV/JSON file of locations, and add them as favorites."""
+
+    if not g.user:
+        flash("Must be logged in to use Favorites feature.", "danger")
+        return redirect("/login")
+
+    form = ImportFavoritesForm()
+    loc_form = LocationSearchForm()
+
+    if loc_form.search.data and loc_form.validate():
+        loc_id = do_loc_search(loc_form)
+
+        return redirect(f"/locs/{loc_id}" if loc_id else request.path)
+
+    if form.submit.data and form.validate():
+        upload = form.file.data
+
+        try:
+            rows = parse_rows(upload.stream, upload.filename)
+        except (ValueError, UnicodeDecodeError, csv.Error):
+            form.file.errors = ["Could not read that file."]
+            return render_template("import.html", form=form, loc_form=loc_form)
+
+        if len(rows) > app.config["IMPORT_MAX_ROWS"]:
+            form.file.errors = [
+                f"At most {app.config['IMPORT_MAX_ROWS']} rows per file; "
+                "split the file."
+            ]
+            return render_template("import.html", form=form, loc_form=loc_form)
+
+        if lookups_needed(rows) > app.config["IMPORT_MAX_LOOKUPS"]:
+            form.file.errors = [
+                f"At most {app.config['IMPORT_MAX_LOOKUPS']} addresses per file; "
+                "split the file or give lat/long columns."
+            ]
+            return render_template("import.html", form=form, loc_form=loc_form)
+
+        result = import_favorites(
+            app, g.user.id, rows, app.config["IMPORT_BATCH_SIZE"]
+        )
+        invalidate_user(app, g.user.id)
+
+        flash(
+            f"Added {result['favorites']} favorites "
+            f"({result['locations']} new locations).",
+            "success",
+        )
+        if result["errors"]:
+            flash(error_summary(result["errors"]), "danger")
+        return redirect("/")
+
+    else:
+        return render_template("import.html", form=form, loc_form=loc_form)
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    """Upload bigger than MAX_CONTENT_LENGTH: say so on the import page."""
+
+    if request.endpoint != "import_favs":
+        return e
+
+    mb = app.config["MAX_CONTENT_LENGTH"] / (1024 * 1024)
+    flash(f"That file is too large (at most {mb:g}MB).", "danger")
+    return redirect("/favorites/import")
+
+
+@app.route("/favorites/export")
+def export_favs():
+    """Download user's favorites as CSV (or JSON with ?format=json)."""
+
+    if not g.user:
+        flash("Must be logged in to use Favorites feature.", "danger")
+        return redirect("/login")
+
+    if request.args.get("format") == "json":
+        rows, mimetype, ext = export_json(g.user.id), "application/json", "json"
+    else:
+        rows, mimetype, ext = export_csv(g.user.id), "text/csv", "csv"
+
+    return Response(
+        stream_with_context(rows),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=favorites.{ext}"},
+    )
@@ -0,0 +1,134 @@
+"""Static asset fingerprinting, caching and response compression."""
+
+import gzip
+import hashlib
+import os
+
+from flask import current_app, g, request
+
+# a year; fingerprinted URLs change whenever the file does
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+COMPRESS_MIMETYPES = {
+    "text/html",
+    "text/css",
+    "text/csv",
+    "application/javascript",
+    "application/json",
+}
+COMPRESS_MIN_SIZE = 500
+
+_fingerprints = {}
+_gzipped = {}
+
+
+def fingerprint(app, filename):
+    """Return short hash of static file's contents (cached per process)."""
+
+    path = os.path.join(app.static_folder, filename)
+    mtime = os.path.getmtime(path)
+    cached = _fingerprints.get(path)
+
+    if cached is None or cached[0] != mtime:
+        with open(path, "rb") as f:
+            cached = (mtime, hashlib.md5(f.read()).hexdigest()[:12])
+        _fingerprints[path] = cached
+
+    return cached[1]
+
+
+def init_assets(app):
+    """Add fingerprinting, cache headers and gzip to the app.
+
+    Call before other extensions that rewrite the HTML (the debug toolbar),
+    so compression runs after them.
+    """
+
+    @app.url_defaults
+    def add_static_fingerprint(endpoint, values):
+        """url_for('static', ...) gets ?v=<hash> so it can be cached forever."""
+
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            try:
+                values["v"] = fingerprint(app, values["filename"])
+            except OSError:
+                pass
+
+    @app.after_request
+    def compress_and_cache(response):
+        if request.endpoint == "static" and request.args.get("v"):
+            filename = request.view_args.get("filename")
+            try:
+                current = fingerprint(app, filename)
+            except OSError:
+                current = None
+
+            # only the real current hash is safe to cache for a year
+            if request.args["v"] == current:
+                response.cache_control.no_cache = None
+                response.cache_control.public = True
+                response.cache_control.max_age = STATIC_MAX_AGE
+                response.cache_control.immutable = True
+
+                return compress(response, cache_key=(filename, current))
+
+        return compress(response)
+
+
+def compress(response, cache_key=None):
+    """Gzip response body if the client accepts it and it's worth it."""
+
+    if (
+        response.status_code != 200
+        or response.mimetype not in COMPRESS_MIMETYPES
+        or "Content-Encoding" in response.headers
+        or "gzip" not in request.headers.get("Accept-Encoding", "").lower()
+        # leave generators (like favorites export) streaming
+        or (response.is_streamed and not response.direct_passthrough)
+        or _has_csrf_token(response)
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    # static files are sent straight from disk; read them so they can be gzipped
+    response.direct_passthrough = False
+    data = response.get_data()
+
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    # one gzipped copy per static file, replaced when its fingerprint changes
+    body = None
+    if cache_key:
+        filename, version = cache_key
+        cached = _gzipped.get(filename)
+        if cached and cached[0] == version:
+            body = cached[1]
+
+    if body is None:
+        body = gzip.compress(data, compresslevel=6)
+        if cache_key:
+            _gzipped[filename] = (version, body)
+
+    response.set_data(body)
+    response.headers["Content-Encoding"] = "gzip"
+
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-gzip", weak)
+        # send_file only compared If-None-Match to the plain etag, so check
+        # again against the one the client was actually given
+        response.make_conditional(request)
+
+    return response
+
+
+def _has_csrf_token(response):
+    """Whether response is a page with this request's CSRF token in it.
+
+    Gzipped pages that hold a secret and echo user input leak the secret
+    through their compressed size (BREACH), so those are sent uncompressed.
+    """
+
+    field_name = current_app.config.get("WTF_CSRF_FIELD_NAME", "csrf_token")
+    return response.mimetype == "text/html" and field_name in g
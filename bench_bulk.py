@@ -0,0 +1,64 @@
+"""Time bulk import and export of favorites.
+
+Run against a scratch database with the offline weather provider, like:
+
+    DATABASE_URL=postgresql:///weather-bench WEATHER_PROVIDERS=fixture python3 bench_bulk.py
+
+This drops and recreates all tables in DATABASE_URL.
+"""
+
+import io
+import sys
+import time
+
+from app import app
+from models import db, User
+from bulk import parse_rows, import_favorites, export_csv
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+
+def make_csv(rows):
+    """Half addresses, half lat/long pairs, with some repeats."""
+
+    lines = ["address,lat,long"]
+    for i in range(rows):
+        if i % 2:
+            lines.append(f"Site {i % (rows // 4 + 1)},,")
+        else:
+            lines.append(f",{(i % 1800) / 10 - 90},{(i // 1800) / 10}")
+    return "\n".join(lines).encode()
+
+
+def timed(label, rows, func):
+    start = time.perf_counter()
+    result = func()
+    secs = time.perf_counter() - start
+    print(f"{label:<24}{secs:8.2f}s {rows / secs:10.0f} rows/s")
+    return result
+
+
+with app.app_context():
+    db.engine.echo = False
+    db.drop_all()
+    db.create_all()
+    user = User.register("bench@bench.com", "password")
+    db.session.commit()
+
+    data = make_csv(ROWS)
+    rows = timed("parse csv", ROWS, lambda: parse_rows(io.BytesIO(data), "bench.csv"))
+    result = timed(
+        "import (new locations)",
+        ROWS,
+        lambda: import_favorites(app, user.id, rows, app.config["IMPORT_BATCH_SIZE"]),
+    )
+    print(f"  {result['locations']} locations, {result['favorites']} favorites")
+
+    other = User.register("bench2@bench.com", "password")
+    db.session.commit()
+    timed(
+        "import (existing)",
+        ROWS,
+        lambda: import_favorites(app, other.id, rows, app.config["IMPORT_BATCH_SIZE"]),
+    )
+    timed("export csv", result["favorites"], lambda: sum(1 for _ in export_csv(user.id)))
@@ -0,0 +1,99 @@
+"""Measure page weight and render-blocking resources of the main pages.
+
+"server time" is how long the app takes to answer in-process, without
+network or browser. Time to first render was not measured; that needs a
+real browser (e.g. Lighthouse).
+
+Run against a scratch database with the offline weather provider, like:
+
+    DATABASE_URL=postgresql:///weather-bench WEATHER_PROVIDERS=fixture python3 bench_pages.py
+
+This drops and recreates all tables in DATABASE_URL.
+"""
+
+import gzip
+import re
+import time
+from html.parser import HTMLParser
+
+from app import app
+from models import db, Location
+
+RUNS = 50
+
+
+class ResourceParser(HTMLParser):
+    """Collect stylesheets, scripts and iframes a page loads."""
+
+    def __init__(self):
+        super().__init__()
+        self.in_head = False
+        self.in_noscript = False
+        self.blocking = []
+        self.iframes = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "head":
+            self.in_head = True
+        elif tag == "noscript":
+            self.in_noscript = True
+        elif tag == "link" and attrs.get("rel") == "stylesheet":
+            self.blocking.append(attrs["href"])
+        elif tag == "script" and attrs.get("src") and self.in_head:
+            if "defer" not in attrs and "async" not in attrs:
+                self.blocking.append(attrs["src"])
+        elif tag == "iframe" and not self.in_noscript:
+            self.iframes.append("deferred" if "src" not in attrs else "eager")
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.in_head = False
+        elif tag == "noscript":
+            self.in_noscript = False
+
+
+def measure(client, url):
+    headers = {"Accept-Encoding": "gzip"}
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        resp = client.get(url, headers=headers)
+    ms = (time.perf_counter() - start) / RUNS * 1000
+
+    parser = ResourceParser()
+    html = resp.get_data()
+    if resp.content_encoding == "gzip":
+        html = gzip.decompress(html)
+    parser.feed(html.decode("utf8"))
+
+    print(f"{url}")
+    print(f"  server time {ms:8.1f} ms")
+    print(f"  html        {len(resp.get_data()):8d} bytes sent ({len(html)} raw)")
+
+    for href in parser.blocking:
+        if re.match(r"https?://", href):
+            print(f"  blocking    {'third-party':>8} {href}")
+        else:
+            asset = client.get(href, headers=headers)
+            print(
+                f"  blocking    {len(asset.get_data()):8d} bytes sent "
+                f"{href} (Cache-Control: {asset.cache_control})"
+            )
+            asset.close()
+
+    for iframe in parser.iframes:
+        print(f"  iframe      {iframe}")
+
+
+with app.app_context():
+    db.engine.echo = False
+    db.drop_all()
+    db.create_all()
+    loc = Location(address="Bench", lat=39.7392, long=-104.9903)
+    db.session.add(loc)
+    db.session.commit()
+    loc_id = loc.id
+
+client = app.test_client()
+measure(client, "/")
+measure(client, f"/locs/{loc_id}")
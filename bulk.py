@@ -0,0 +1,233 @@
+"""Bulk import and export of favorites for weather app."""
+
+import csv
+import io
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import tuple_
+
+from models import db, Location, Favorite
+from weather import get_weather_service, normalize_query
+
+EXPORT_FIELDS = ["address", "lat", "long"]
+
+# skipped rows are reported in a flash, which lives in the session cookie
+# (browsers drop cookies over 4KB), so keep the report short
+ERROR_SUMMARY_ROWS = 10
+ERROR_SUMMARY_LENGTH = 500
+ERROR_QUERY_LENGTH = 30
+
+
+def parse_rows(stream, filename):
+    """Read uploaded CSV or JSON file into a list of row dicts of strings.
+
+    Each row has either an "address" (searched like the search bar) or a
+    "lat" and "long" pair. JSON must be a list of such objects or of plain
+    search strings. Raises ValueError if the file isn't shaped like that.
+    """
+
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig")
+
+    if filename.lower().endswith(".json"):
+        rows = json.load(text)
+        if not isinstance(rows, list):
+            raise ValueError("JSON file must be a list of locations")
+        return [
+            _clean(row) if isinstance(row, dict) else _clean({"address": row})
+            for row in rows
+        ]
+
+    return [_clean(row) for row in csv.DictReader(text)]
+
+
+def _clean(row):
+    # CSV gives None for missing cells (and a None key for extra ones),
+    # JSON can give numbers, so make every value a string
+    return {
+        str(key): "" if value is None else str(value).strip()
+        for key, value in row.items()
+        if key is not None
+    }
+
+
+def _coords(lat, long):
+    """Return (lat, long) as floats, or None if they aren't a real place."""
+
+    try:
+        lat, long = float(lat), float(long)
+    except ValueError:
+        return None
+
+    if not (math.isfinite(lat) and math.isfinite(long)):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= long <= 180):
+        return None
+
+    return lat, long
+
+
+def lookups_needed(rows):
+    """Number of distinct addresses in rows that must be resolved upstream."""
+
+    return len(
+        {
+            normalize_query(row.get("address", ""))
+            for row in rows
+            if not (row.get("lat") or row.get("long")) and row.get("address")
+        }
+    )
+
+
+def resolve_rows(app, rows, batch_size=50):
+    """Turn rows into {(lat, long): address}, resolving addresses upstream.
+
+    Rows that already have lat/long are used as they are. Each distinct
+    address is only resolved once, up to batch_size at a time in parallel
+    (also limited by the weather service's thread pool).
+    Returns (found, errors) where errors describes each row that was skipped.
+    """
+
+    found = {}
+    queries = []
+    errors = []
+
+    for n, row in enumerate(rows, 1):
+        lat, long = row.get("lat", ""), row.get("long", "")
+        address = row.get("address", "")
+
+        if lat or long:
+            coords = _coords(lat, long)
+            if coords:
+                found.setdefault(coords, address or None)
+            else:
+                errors.append(f"row {n}: bad lat/long")
+        elif address:
+            queries.append(address)
+        else:
+            errors.append(f"row {n}: no address or lat/long")
+
+    queries = list(dict.fromkeys(queries))
+    service = get_weather_service(app)
+
+    def resolve(query):
+        try:
+            return query, service.resolve(query)
+        except Exception:
+            return query, None
+
+    # separate pool, since service.resolve itself waits on service.executor
+    workers = max(1, min(batch_size, service.max_workers))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start : start + batch_size]
+            for query, data in pool.map(resolve, batch):
+                if data is None:
+                    errors.append(f"could not find {_shorten(query)!r}")
+                else:
+                    found.setdefault(
+                        (data["latitude"], data["longitude"]), data["resolvedAddress"]
+                    )
+
+    return found, errors
+
+
+def _shorten(text, length=ERROR_QUERY_LENGTH):
+    return text if len(text) <= length else text[: length - 3] + "..."
+
+
+def error_summary(errors):
+    """One line describing the skipped rows, short enough to flash."""
+
+    summary = f"Skipped {len(errors)} rows: " + "; ".join(errors[:ERROR_SUMMARY_ROWS])
+    return _shorten(summary, ERROR_SUMMARY_LENGTH)
+
+
+def _location_ids(pairs):
+    """Return {(lat, long): id} for the Location rows matching pairs."""
+
+    ids = {}
+    pairs = list(pairs)
+
+    # keep the IN list a reasonable size for the database
+    for start in range(0, len(pairs), 1000):
+        chunk = pairs[start : start + 1000]
+        matches = db.session.query(Location.id, Location.lat, Location.long).filter(
+            tuple_(Location.lat, Location.long).in_(chunk)
+        )
+        ids.update({(lat, long): id for id, lat, long in matches})
+
+    return ids
+
+
+def import_favorites(app, user_id, rows, batch_size=50):
+    """Add locations in rows to user's favorites.
+
+    Returns dict with counts of new locations, new favorites, and the list
+    of rows that were skipped.
+    """
+
+    found, errors = resolve_rows(app, rows, batch_size)
+    ids = _location_ids(found)
+
+    new_locs = [
+        {"address": address, "lat": lat, "long": long}
+        for (lat, long), address in found.items()
+        if (lat, long) not in ids
+    ]
+    if new_locs:
+        Location.insert_new(new_locs)
+        ids = _location_ids(found)
+
+    existing_favs = {
+        loc_id
+        for (loc_id,) in db.session.query(Favorite.location_id).filter(
+            Favorite.user_id == user_id
+        )
+    }
+    new_favs = [
+        {"user_id": user_id, "location_id": loc_id}
+        for loc_id in set(ids.values()) - existing_favs
+    ]
+    if new_favs:
+        db.session.execute(Favorite.__table__.insert(), new_favs)
+
+    db.session.commit()
+
+    return {"locations": len(new_locs), "favorites": len(new_favs), "errors": errors}
+
+
+def _favorite_rows(user_id):
+    return (
+        db.session.query(Location.address, Location.lat, Location.long)
+        .join(Favorite, Favorite.location_id == Location.id)
+        .filter(Favorite.user_id == user_id)
+        .order_by(Location.id)
+        .yield_per(1000)
+    )
+
+
+def export_csv(user_id):
+    """Yield user's favorites as CSV text, a row at a time."""
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_FIELDS)
+
+    for row in _favorite_rows(user_id):
+        writer.writerow(row)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+    yield buf.getvalue()
+
+
+def export_json(user_id):
+    """Yield user's favorites as a JSON list, a row at a time."""
+
+    yield "["
+    for i, row in enumerate(_favorite_rows(user_id)):
+        yield ("," if i else "") + json.dumps(dict(zip(EXPORT_FIELDS, row)))
+    yield "]"
@@ -0,0 +1,274 @@
+"""Shared cache, server-side sessions and user cache for weather app."""
+
+import json
+import secrets
+import threading
+import time
+
+from flask.sessions import SessionInterface, SecureCookieSession
+from itsdangerous import Signer, BadSignature
+
+from models import User, Location
+
+KEY_PREFIX = "weather:"
+
+
+class LocalStore:
+    """In-process key/value store with expiry.
+
+    Only shared between threads of one worker, so it is only used for the
+    user cache; set REDIS_URL to share it (and sessions) between workers.
+    Holds at most max_entries; expired entries are swept when it fills up,
+    then the oldest ones are dropped.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            return json.loads(value)
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def add(self, key, value, ttl):
+        """Set key only if it isn't already set; return whether it was set."""
+
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] >= time.monotonic():
+                return False
+            self._set(key, value, ttl)
+            return True
+
+    def _set(self, key, value, ttl):
+        self._data.pop(key, None)
+        if len(self._data) >= self.max_entries:
+            self._evict()
+        self._data[key] = (json.dumps(value), time.monotonic() + ttl)
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [key for key, (_, expires) in self._data.items() if expires < now]:
+            del self._data[key]
+
+        # dicts keep insertion order, so this drops the oldest entries
+        while len(self._data) >= self.max_entries:
+            del self._data[next(iter(self._data))]
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisStore:
+    """Key/value store in Redis, shared by all worker processes."""
+
+    def __init__(self, url):
+        # only needed when REDIS_URL is set
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get(KEY_PREFIX + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.set(KEY_PREFIX + key, json.dumps(value), ex=max(int(ttl), 1))
+
+    def add(self, key, value, ttl):
+        """Set key only if it isn't already set; return whether it was set."""
+
+        return bool(
+            self.client.set(
+                KEY_PREFIX + key, json.dumps(value), ex=max(int(ttl), 1), nx=True
+            )
+        )
+
+    def delete(self, key):
+        self.client.delete(KEY_PREFIX + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(KEY_PREFIX + "*"):
+            self.client.delete(key)
+
+
+def get_store(app):
+    """Return the app's store, building it from config on first use."""
+
+    store = app.extensions.get("cache_store")
+
+    if store is None:
+        url = app.config.get("REDIS_URL")
+        store = RedisStore(url) if url else LocalStore()
+        app.extensions["cache_store"] = store
+
+    return store
+
+
+class ServerSideSession(SecureCookieSession):
+    """Session whose data lives in the store; the cookie only holds its id."""
+
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid or secrets.token_urlsafe(32)
+        self.old_sid = None
+
+    def regenerate(self):
+        """Move data to a new id, so an id known before login is useless."""
+
+        if self.old_sid is None:
+            self.old_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+def regenerate_session(session):
+    """Give a server-side session a new id (signed-cookie sessions need not)."""
+
+    if isinstance(session, ServerSideSession):
+        session.regenerate()
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keep session data in a shared store instead of a signed cookie.
+
+    Only use with a store every worker process shares (Redis).
+    """
+
+    salt = "server-side-session"
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return ServerSideSession()
+
+        try:
+            sid = self._signer(app).unsign(cookie).decode("utf8")
+        except BadSignature:
+            return ServerSideSession()
+
+        data = self.store.get(f"session:{sid}")
+        if data is None:
+            return ServerSideSession()
+
+        return ServerSideSession(data, sid=sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.old_sid is not None:
+            self.store.delete(f"session:{session.old_sid}")
+
+        if not session:
+            if session.modified:
+                self.store.delete(f"session:{session.sid}")
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        ttl = app.permanent_session_lifetime.total_seconds()
+        self.store.set(f"session:{session.sid}", dict(session), ttl)
+
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode("utf8"),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+class CachedUser:
+    """Snapshot of a user (id, email, favorite ids) stored in the cache.
+
+    Used as g.user so most pages don't need to query the users table;
+    load the real User when it needs to be changed.
+    """
+
+    def __init__(self, id, email, favorite_ids):
+        self.id = id
+        self.email = email
+        self.favorite_ids = set(favorite_ids)
+        self._favorites = None
+
+    @property
+    def favorites(self):
+        """Favorite locations, only queried when a page lists them."""
+
+        if self._favorites is None:
+            self._favorites = (
+                Location.query.filter(Location.id.in_(self.favorite_ids))
+                .order_by(Location.id)
+                .all()
+                if self.favorite_ids
+                else []
+            )
+        return self._favorites
+
+
+def load_user(app, user_id):
+    """Return CachedUser for user_id, from the cache if possible, or None.
+
+    With USER_CACHE_TTL 0 the user is always loaded from the database.
+    """
+
+    ttl = app.config.get("USER_CACHE_TTL", 0)
+    store = get_store(app)
+    key = f"user:{user_id}"
+    data = store.get(key) if ttl else None
+
+    if data is None:
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+        data = {
+            "id": user.id,
+            "email": user.email,
+            "favorite_ids": [loc.id for loc in user.favorites],
+        }
+        if ttl:
+            store.set(key, data, ttl)
+
+    return CachedUser(**data)
+
+
+def invalidate_user(app, user_id):
+    """Drop cached copy of user, so the next request reloads it."""
+
+    get_store(app).delete(f"user:{user_id}")
@@ -1,6 +1,7 @@
 """Forms for weather app."""
 
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import InputRequired, Email
 
@@ -26,3 +27,11 @@ class LocationSearchForm(FlaskForm):
 
     location = StringField('Location')
     search = SubmitField('Search')
+
+
+class ImportFavoritesForm(FlaskForm):
+    '''Form for uploading a CSV or JSON file of favorite locations.'''
+
+    file = FileField('File', validators=[
+        FileRequired(), FileAllowed(['csv', 'json'], 'CSV or JSON files only.')])
+    submit = SubmitField('Import')
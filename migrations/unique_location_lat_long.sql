@@ -0,0 +1,41 @@
+-- Merge duplicate locations and add the unique (lat, long) constraint that
+-- the Location model declares. Databases made with db.create_all() after
+-- that change already have it; run this once on an older database before
+-- deploying, like:
+--
+--    psql "$DATABASE_URL" -f migrations/unique_location_lat_long.sql
+--
+-- It runs in one transaction, so if anything fails nothing is changed.
+
+BEGIN;
+
+-- keep other requests from adding locations or favorites while merging
+LOCK TABLE locations, favorites IN SHARE ROW EXCLUSIVE MODE;
+
+-- point favorites at the oldest location with the same lat/long
+UPDATE favorites
+SET location_id = (
+    SELECT MIN(keep.id)
+    FROM locations keep, locations dup
+    WHERE dup.id = favorites.location_id
+      AND keep.lat = dup.lat
+      AND keep.long = dup.long
+)
+WHERE location_id IS NOT NULL;
+
+-- a user who saved two copies of a location now has the same favorite twice
+DELETE FROM favorites
+WHERE id NOT IN (
+    SELECT MIN(id) FROM favorites GROUP BY user_id, location_id
+);
+
+-- nothing refers to the newer copies any more
+DELETE FROM locations
+WHERE id NOT IN (
+    SELECT MIN(id) FROM locations GROUP BY lat, long
+);
+
+-- same name db.create_all() gives it
+ALTER TABLE locations ADD CONSTRAINT locations_lat_long_key UNIQUE (lat, long);
+
+COMMIT;
@@ -2,6 +2,8 @@
 
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
@@ -58,12 +60,58 @@ class Location(db.Model):
     """A location for which weather data has been fetched."""
 
     __tablename__ = 'locations'
+    __table_args__ = (db.UniqueConstraint('lat', 'long'),)
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     address = db.Column(db.Text, nullable=True)
     lat = db.Column(db.Float, nullable=False)
     long = db.Column(db.Float, nullable=False)
 
+    @classmethod
+    def insert_new(cls, rows):
+        '''Insert location dicts, skipping any whose lat/long is already stored.
+
+        Safe when another request inserts the same location at the same time.
+        '''
+
+        dialect = db.session.get_bind().dialect.name
+
+        if dialect == 'postgresql':
+            stmt = postgresql.insert(cls.__table__)
+        elif dialect == 'sqlite':
+            stmt = sqlite.insert(cls.__table__)
+        else:
+            # no ON CONFLICT; insert one at a time, skipping duplicates
+            for row in rows:
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(cls.__table__.insert(), row)
+                except IntegrityError:
+                    pass
+            return
+
+        stmt = stmt.on_conflict_do_nothing(index_elements=['lat', 'long'])
+        db.session.execute(stmt, rows)
+
+    @classmethod
+    def get_or_create(cls, address, lat, long):
+        '''Return id of location at lat/long, adding it if it's new.
+
+        Like User.register, leaves committing to the caller.
+        '''
+
+        cls.insert_new([{'address': address, 'lat': lat, 'long': long}])
+
+        # oldest first, matching migrations/unique_location_lat_long.sql,
+        # in case the database still has duplicates from before the constraint
+        return (
+            db.session.query(cls.id)
+            .filter_by(lat=lat, long=long)
+            .order_by(cls.id)
+            .limit(1)
+            .scalar()
+        )
+
 
 class Favorite(db.Model):
     """Locations that a user saves as favorites."""
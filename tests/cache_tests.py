@@ -0,0 +1,39 @@
+"""Cache store tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest tests/cache_tests.py
+
+import time
+from unittest import TestCase
+from cache import LocalStore
+
+
+class LocalStoreTestCase(TestCase):
+    """Test in-process store."""
+
+    def test_get_set_delete(self):
+        store = LocalStore()
+        store.set("a", {"x": 1}, 60)
+        self.assertEqual(store.get("a"), {"x": 1})
+        store.delete("a")
+        self.assertIsNone(store.get("a"))
+
+    def test_expired_entries_swept_when_full(self):
+        store = LocalStore(max_entries=5)
+        for i in range(5):
+            store.set(f"old{i}", i, 0.01)
+        time.sleep(0.02)
+
+        store.set("new", 1, 60)
+        self.assertEqual(len(store._data), 1)
+
+    def test_size_is_capped(self):
+        store = LocalStore(max_entries=5)
+        for i in range(20):
+            store.set(f"k{i}", i, 60)
+
+        self.assertEqual(len(store._data), 5)
+        # oldest entries go first
+        self.assertIsNone(store.get("k0"))
+        self.assertEqual(store.get("k19"), 19)
@@ -4,8 +4,9 @@
 #
 #    python3 -m unittest tests/models_tests.py
 
-from unittest import TestCase
-from sqlalchemy import exc
+from types import SimpleNamespace
+from unittest import TestCase, mock
+from sqlalchemy import exc, Table, MetaData, Column, Integer, Text, Float
 from flask import session, g
 from flask_sqlalchemy import SQLAlchemy
 from app import app
@@ -176,6 +177,57 @@ class LocationModelTestCase(TestCase):
             # Location should have no associated users
             self.assertEqual(len(l.users), 0)
 
+    def test_duplicate_location(self):
+        with app.app_context():
+            db.session.add(Location(address="Dup", lat=-90.0, long=-180.0))
+            with self.assertRaises(exc.IntegrityError):
+                db.session.commit()
+
+    def test_get_or_create(self):
+        with app.app_context():
+            self.assertEqual(Location.get_or_create("Test1", -90.0, -180.0), self.lid1)
+
+            lid = Location.get_or_create("New", 1.5, 2.5)
+            db.session.commit()
+            self.assertEqual(Location.get_or_create("New", 1.5, 2.5), lid)
+            db.session.commit()
+            self.assertEqual(Location.query.filter_by(lat=1.5, long=2.5).count(), 1)
+
+    def test_get_or_create_with_duplicates(self):
+        with app.app_context():
+            # locations table as it was before the unique constraint
+            db.drop_all()
+            old = Table(
+                "locations",
+                MetaData(),
+                Column("id", Integer, primary_key=True),
+                Column("address", Text),
+                Column("lat", Float, nullable=False),
+                Column("long", Float, nullable=False),
+            )
+            old.create(db.engine)
+            db.session.execute(old.insert(), [
+                {"id": 7, "address": "Dup", "lat": 1.0, "long": 2.0},
+                {"id": 5, "address": "Dup", "lat": 1.0, "long": 2.0},
+            ])
+
+            with mock.patch.object(Location, "insert_new"):
+                self.assertEqual(Location.get_or_create("Dup", 1.0, 2.0), 5)
+
+    def test_insert_new_other_database(self):
+        other = SimpleNamespace(dialect=SimpleNamespace(name="mysql"))
+
+        with app.app_context():
+            with mock.patch.object(db.session, "get_bind", return_value=other):
+                Location.insert_new([
+                    {"address": "Dup", "lat": -90.0, "long": -180.0},
+                    {"address": "New", "lat": 3.0, "long": 4.0},
+                ])
+            db.session.commit()
+
+            self.assertEqual(Location.query.filter_by(lat=-90.0, long=-180.0).one().address, "Test1")
+            self.assertEqual(Location.query.filter_by(lat=3.0, long=4.0).count(), 1)
+
 class FavoriteModelTestCase(TestCase):
     """Test favorite model."""
 
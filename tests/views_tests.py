@@ -4,10 +4,16 @@
 #
 #    FLASK_ENV=production python3 -m unittest tests/views_tests.py
 
+import gzip
+import io
+import json
+import re
 from unittest import TestCase
 from sqlalchemy import exc
 from flask import session, g
 from app import app, CURR_USER_KEY
+from cache import get_store, LocalStore, ServerSideSessionInterface
+from weather import WeatherService
 from models import db, connect_db, User, Location, Favorite
 
 # different database for tests
@@ -16,6 +22,8 @@ app.config["SQLALCHEMY_DATABASE_URI"] = "postgresql:///weather-test"
 app.config["SQLALCHEMY_ECHO"] = False
 # Make Flask errors be real errors, rather than HTML pages with error info
 app.config["TESTING"] = True
+# serve weather data from the local fixture instead of the real API
+app.config["WEATHER_PROVIDERS"] = ["fixture"]
 
 
 # Don't have WTForms use CSRF at all, since it's a pain to test
@@ -31,6 +39,7 @@ class ViewTestCase(TestCase):
         with app.app_context():
             db.drop_all()
             db.create_all()
+            get_store(app).clear()
 
             self.client = app.test_client()
 
@@ -84,6 +93,42 @@ class ViewTestCase(TestCase):
 
             self.assertIn("Test1", str(resp.data))
 
+    def with_weather_down(self):
+        class DownProvider:
+            name = "down"
+
+            def resolve(self, query):
+                raise ConnectionError("down")
+
+            def forecast(self, lat, long):
+                raise ConnectionError("down")
+
+        # drop the down service afterwards; the next request rebuilds it
+        app.extensions["weather"] = WeatherService([DownProvider()])
+        self.addCleanup(app.extensions.pop, "weather", None)
+
+    def test_location_when_weather_down(self):
+        self.with_weather_down()
+        with self.client as c:
+            resp = c.get(f"/locs/{self.lid1}")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Test1", str(resp.data))
+            self.assertIn("weather service is unavailable", str(resp.data))
+
+    def test_search_when_weather_down(self):
+        self.with_weather_down()
+        with self.client as c:
+            resp = c.post(
+                f"/locs/{self.lid1}",
+                data={"location": "Denver", "search": "Search"},
+                follow_redirects=True,
+            )
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Test1", str(resp.data))
+            self.assertIn("weather service is unavailable", str(resp.data))
+
     def setup_favorites(self):
         with app.app_context():
             u1 = User.query.get(self.uid1)
@@ -125,3 +170,359 @@ class ViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn("Your Favorites", str(resp.data))
             self.assertIn("Test1", str(resp.data))
+
+    def test_update_fav_refreshes_cached_user(self):
+        # as with REDIS_URL set; tests run in one process, so LocalStore is shared
+        app.config["USER_CACHE_TTL"] = 60
+        self.addCleanup(app.config.__setitem__, "USER_CACHE_TTL", 0)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid1
+
+            # first request caches user with no favorites
+            resp = c.get(f"/locs/{self.lid1}")
+            self.assertIn("Save as favorite", str(resp.data))
+
+            c.post(f"/update-fav/{self.lid1}")
+            resp = c.get(f"/locs/{self.lid1}")
+            self.assertIn("Remove from favorites", str(resp.data))
+
+            c.post(f"/update-fav/{self.lid1}")
+            resp = c.get(f"/locs/{self.lid1}")
+            self.assertIn("Save as favorite", str(resp.data))
+
+    def test_logout_clears_session(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid1
+
+            c.get("/logout")
+            resp = c.get("/")
+            self.assertIn("Login", str(resp.data))
+            self.assertNotIn("test1@test.com", str(resp.data))
+
+    def test_import_favorites(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid1
+
+            csv_file = (
+                "address,lat,long\n"
+                "Test1,-90.0,-180.0\n"
+                "Somewhere,,\n"
+                "somewhere,,\n"
+                ",10.5,20.5\n"
+            )
+            resp = c.post(
+                "/favorites/import",
+                data={"file": (io.BytesIO(csv_file.encode()), "favs.csv"), "submit": "Import"},
+                content_type="multipart/form-data",
+                follow_redirects=True,
+            )
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Added 3 favorites (2 new locations).", str(resp.data))
+
+        with app.app_context():
+            self.assertEqual(len(User.query.get(self.uid1).favorites), 3)
+            # existing location reused, repeated address only added once
+            self.assertEqual(Location.query.count(), 4)
+
+    def upload(self, client, body, filename="favs.json"):
+        return client.post(
+            "/favorites/import",
+            data={"file": (io.BytesIO(body.encode()), filename), "submit": "Import"},
+            content_type="multipart/form-data",
+            follow_redirects=True,
+        )
+
+    def test_import_rejects_non_list_json(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid1
+
+            for body in ["5", "null", '{"address": "Denver"}', "not json"]:
+                resp = self.upload(c, body)
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("Could not read that file.", str(resp.data))
+
+    def test_import_non_string_values(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid1
+
+            resp = self.upload(c, '[{"address": 12}, 34, null, {"lat": 1, "long": 2}]')
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Added 3 favorites", str(resp.data))
+            self.assertIn("row 3: no address or lat/long", str(resp.data))
+
+    def test_import_bad_coordinates(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid1
+
+            resp = self.upload(
+                c,
+                '[{"lat": "nan", "long": "1"}, {"lat": "1", "long": "inf"},'
+                ' {"lat": "91", "long": "0"}, {"lat": "0", "long": "-180.5"},'
+                ' {"lat": "x", "long": "0"}, {"lat": "45", "long": "90"}]',
+            )
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Added 1 favorites", str(resp.data))
+            self.assertIn("Skipped 5 rows", str(resp.data))
+
+        with app.app_context():
+            self.assertEqual(Location.query.count(), 3)
+
+    def test_import_limits_lookups(self):
+        app.config["IMPORT_MAX_LOOKUPS"] = 2
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.uid1
+
+                resp = self.upload(c, '["A", "a ", "B", {"lat": 1, "long": 2}]')
+                self.assertIn("Added 3 favorites", str(resp.data))
+
+                resp = self.upload(c, '["A", "B", "C"]')
+                self.assertIn("At most 2 addresses per file", str(resp.data))
+        finally:
+            app.config["IMPORT_MAX_LOOKUPS"] = 1000
+
+    def test_import_errors_fit_in_cookie(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid1
+
+            rows = [{"lat": "1" * 600, "long": "0"} for _ in range(10)]
+            resp = c.post(
+                "/favorites/import",
+                data={
+                    "file": (io.BytesIO(json.dumps(rows).encode()), "favs.json"),
+                    "submit": "Import",
+                },
+                content_type="multipart/form-data",
+            )
+            self.assertLess(len(resp.headers["Set-Cookie"]), 4096)
+
+            resp = c.get("/")
+            self.assertIn("Skipped 10 rows: row 1: bad lat/long; row 2", str(resp.data))
+            self.assertNotIn("1" * 600, str(resp.data))
+
+    def test_import_limits_rows(self):
+        app.config["IMPORT_MAX_ROWS"] = 2
+        self.addCleanup(app.config.__setitem__, "IMPORT_MAX_ROWS", 10000)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid1
+
+            resp = self.upload(c, '[{"lat": 1, "long": 2}, {"lat": 3, "long": 4}]')
+            self.assertIn("Added 2 favorites", str(resp.data))
+
+            resp = self.upload(c, '[{"lat": 1, "long": 2}, {"lat": 3, "long": 4}, "A"]')
+            self.assertIn("At most 2 rows per file", str(resp.data))
+
+    def test_import_too_large(self):
+        app.config["MAX_CONTENT_LENGTH"] = 1024
+        self.addCleanup(app.config.__setitem__, "MAX_CONTENT_LENGTH", 2 * 1024 * 1024)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid1
+
+            resp = self.upload(c, json.dumps(["Denver"] * 500))
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("That file is too large", str(resp.data))
+
+        with app.app_context():
+            self.assertEqual(len(User.query.get(self.uid1).favorites), 0)
+
+    def test_import_requires_login(self):
+        with self.client as c:
+            resp = c.get("/favorites/import")
+            self.assertEqual(resp.status_code, 302)
+            self.assertIn("/login", resp.location)
+
+    def test_export_favorites(self):
+        self.setup_favorites()
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid1
+
+            resp = c.get("/favorites/export")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, "text/csv")
+            self.assertEqual(
+                resp.get_data(as_text=True).splitlines(),
+                ["address,lat,long", "Test1,-90.0,-180.0"],
+            )
+
+            resp = c.get("/favorites/export?format=json")
+            self.assertEqual(
+                json.loads(resp.get_data(as_text=True)),
+                [{"address": "Test1", "lat": -90.0, "long": -180.0}],
+            )
+
+    def test_html_is_gzipped(self):
+        with self.client as c:
+            resp = c.get(f"/locs/{self.lid1}", headers={"Accept-Encoding": "gzip"})
+
+            self.assertEqual(resp.content_encoding, "gzip")
+            self.assertIn("Accept-Encoding", resp.vary)
+            self.assertIn("Test1", gzip.decompress(resp.data).decode())
+
+    def test_html_with_csrf_token_not_gzipped(self):
+        app.config["WTF_CSRF_ENABLED"] = True
+        self.addCleanup(app.config.__setitem__, "WTF_CSRF_ENABLED", False)
+
+        with self.client as c:
+            resp = c.get(f"/locs/{self.lid1}", headers={"Accept-Encoding": "gzip"})
+
+            self.assertIn('name="csrf_token"', str(resp.data))
+            self.assertIsNone(resp.content_encoding)
+
+    def test_gzipped_static_revalidates(self):
+        with self.client as c:
+            headers = {"Accept-Encoding": "gzip"}
+            resp = c.get("/static/css/bootstrap.min.css", headers=headers)
+            self.assertEqual(resp.content_encoding, "gzip")
+            etag = resp.headers["ETag"]
+            resp.close()
+
+            resp = c.get(
+                "/static/css/bootstrap.min.css",
+                headers={**headers, "If-None-Match": etag},
+            )
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b"")
+            resp.close()
+
+    def test_static_assets_are_fingerprinted(self):
+        with self.client as c:
+            resp = c.get("/")
+            href = re.search(r'href="(/static/css/bootstrap.min.css\?v=\w+)"', str(resp.data))
+            self.assertIsNotNone(href)
+
+            resp = c.get(href.group(1))
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.cache_control.immutable)
+            self.assertEqual(resp.cache_control.max_age, 365 * 24 * 60 * 60)
+            resp.close()
+
+    def test_unknown_static_version_not_cached(self):
+        with self.client as c:
+            resp = c.get("/static/css/bootstrap.min.css?v=junk0")
+            self.assertEqual(resp.status_code, 200)
+            self.assertFalse(resp.cache_control.immutable)
+            self.assertIsNone(resp.cache_control.max_age)
+            resp.close()
+
+    def test_radar_is_deferred(self):
+        with self.client as c:
+            resp = c.get(f"/locs/{self.lid1}")
+
+            self.assertIn('<iframe data-src="https://www.rainviewer.com', str(resp.data))
+
+    def test_search_reuses_location(self):
+        with self.client as c:
+            resp1 = c.post("/", data={"location": "Denver", "search": "Search"})
+            resp2 = c.post("/", data={"location": " denver", "search": "Search"})
+
+            self.assertEqual(resp1.status_code, 302)
+            self.assertEqual(resp1.location, resp2.location)
+
+        with app.app_context():
+            self.assertEqual(Location.query.count(), 3)
+
+
+class ServerSideSessionTestCase(TestCase):
+    """Test sessions kept in a shared store (as with REDIS_URL set)."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            get_store(app).clear()
+
+            u1 = User.register("test1@test.com", "password")
+            db.session.commit()
+
+        self.old_interface = app.session_interface
+        self.store = LocalStore()
+        app.session_interface = ServerSideSessionInterface(self.store)
+
+    def tearDown(self):
+        app.session_interface = self.old_interface
+        with app.app_context():
+            db.session.rollback()
+
+    def session_cookie(self, client):
+        return next(c.value for c in client.cookie_jar if c.name == "session")
+
+    def test_login_changes_session_id(self):
+        victim = app.test_client()
+        with victim.session_transaction() as sess:
+            sess["visited"] = True
+        before = self.session_cookie(victim)
+
+        resp = victim.post(
+            "/login",
+            data={"email": "test1@test.com", "password": "password", "submit": "Submit"},
+        )
+        self.assertEqual(resp.status_code, 302)
+        self.assertNotEqual(self.session_cookie(victim), before)
+        self.assertIn("test1@test.com", victim.get("/").get_data(as_text=True))
+
+        # someone holding the pre-login cookie is not logged in
+        attacker = app.test_client()
+        attacker.set_cookie("localhost", "session", before)
+        self.assertNotIn("test1@test.com", attacker.get("/").get_data(as_text=True))
+
+    def test_logout_drops_stored_session(self):
+        client = app.test_client()
+        client.post(
+            "/login",
+            data={"email": "test1@test.com", "password": "password", "submit": "Submit"},
+        )
+        logged_in = self.session_cookie(client)
+
+        client.get("/logout")
+
+        attacker = app.test_client()
+        attacker.set_cookie("localhost", "session", logged_in)
+        self.assertNotIn("test1@test.com", attacker.get("/").get_data(as_text=True))
+
+
+class UserCacheTestCase(TestCase):
+    """Test user loading without a shared cache."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            get_store(app).clear()
+
+            u1 = User.register("test1@test.com", "password")
+            l1 = Location(address="Test1", lat=-90.0, long=-180.0)
+            db.session.add(l1)
+            db.session.commit()
+            self.uid1 = u1.id
+            self.lid1 = l1.id
+
+    def test_no_cache_without_redis(self):
+        self.assertEqual(app.config["USER_CACHE_TTL"], 0)
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid1
+            c.get(f"/locs/{self.lid1}")
+
+            # another worker adds the favorite; this one must see it at once
+            with app.app_context():
+                user = User.query.get(self.uid1)
+                user.favorites.append(Location.query.get(self.lid1))
+                db.session.commit()
+
+            resp = c.get(f"/locs/{self.lid1}")
+            self.assertIn("Remove from favorites", str(resp.data))
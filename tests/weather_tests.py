@@ -0,0 +1,183 @@
+"""Weather provider tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest tests/weather_tests.py
+
+import threading
+import time
+from types import SimpleNamespace
+from unittest import TestCase
+from cache import LocalStore
+from weather import (
+    FixtureProvider,
+    WeatherService,
+    WeatherProviderError,
+    get_weather_service,
+)
+
+
+class SlowProvider:
+    name = "slow"
+
+    def resolve(self, query):
+        time.sleep(1)
+        return {"resolvedAddress": "slow"}
+
+
+class BackupProvider:
+    name = "backup"
+
+    def resolve(self, query):
+        return {"resolvedAddress": f"backup {query}"}
+
+
+class BrokenProvider:
+    name = "broken"
+
+    def resolve(self, query):
+        raise ValueError("down")
+
+
+class CountingProvider:
+    name = "counting"
+
+    def __init__(self):
+        self.calls = 0
+        self.delay = 0.2
+
+    def resolve(self, query):
+        self.calls += 1
+        time.sleep(self.delay)
+        return {"resolvedAddress": query, "latitude": 1.0, "longitude": 2.0}
+
+
+class FixtureProviderTestCase(TestCase):
+    """Test local fixture provider."""
+
+    def test_resolve_lat_long(self):
+        data = FixtureProvider().resolve("38.8974,-77.0365")
+        self.assertEqual(data["latitude"], 38.8974)
+        self.assertEqual(data["longitude"], -77.0365)
+
+    def test_resolve_address_is_stable(self):
+        p = FixtureProvider()
+        denver = p.resolve("Denver")
+        self.assertEqual(denver["latitude"], p.resolve("denver ")["latitude"])
+        self.assertNotEqual(denver["latitude"], p.resolve("Boston")["latitude"])
+
+    def test_forecast(self):
+        data = FixtureProvider().forecast(1.0, 2.0)
+        self.assertEqual(data["latitude"], 1.0)
+        self.assertIn("currentConditions", data)
+        self.assertTrue(len(data["days"]) > 0)
+
+
+class WeatherServiceTestCase(TestCase):
+    """Test provider hedging and failover."""
+
+    def test_hedges_slow_provider(self):
+        service = WeatherService([SlowProvider(), BackupProvider()], hedge_after=0.05)
+        start = time.monotonic()
+        data = service.resolve("Denver")
+        self.assertEqual(data["resolvedAddress"], "backup Denver")
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_fails_over_broken_provider(self):
+        service = WeatherService([BrokenProvider(), BackupProvider()], hedge_after=5)
+        start = time.monotonic()
+        self.assertEqual(service.resolve("Denver")["resolvedAddress"], "backup Denver")
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_all_providers_fail(self):
+        service = WeatherService([BrokenProvider()])
+        with self.assertRaises(WeatherProviderError):
+            service.resolve("Denver")
+
+    def test_coalesces_concurrent_requests(self):
+        provider = CountingProvider()
+        service = WeatherService([provider])
+        results = []
+
+        def search(query):
+            results.append(service.resolve(query))
+
+        threads = [
+            threading.Thread(target=search, args=(q,))
+            for q in ["Denver", "denver", " DENVER "] * 5
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(provider.calls, 1)
+        self.assertEqual(len(results), 15)
+        # each caller gets its own copy
+        self.assertEqual(len({id(r) for r in results}), 15)
+
+        service.resolve("Denver")
+        self.assertEqual(provider.calls, 2)
+
+    def test_hedge_timed_from_call_start(self):
+        first, second = CountingProvider(), CountingProvider()
+        first.delay = 0.3
+        service = WeatherService([first, second], hedge_after=0.4, max_workers=1)
+
+        # first call has to queue for 0.5s, longer than hedge_after
+        service.executor.submit(time.sleep, 0.5)
+        service.resolve("Denver")
+        service.executor.submit(lambda: None).result()
+
+        self.assertEqual(first.calls, 1)
+        self.assertEqual(second.calls, 0)
+
+    def test_coalesces_across_processes_through_store(self):
+        # two services sharing a store stand in for two gunicorn workers
+        store = LocalStore()
+        workers = [CountingProvider(), CountingProvider()]
+        services = [WeatherService([p], store=store) for p in workers]
+        results = []
+
+        threads = [
+            threading.Thread(target=lambda s=s: results.append(s.resolve("Denver")))
+            for s in services * 3
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(sum(p.calls for p in workers), 1)
+        self.assertEqual(len(results), 6)
+        self.assertTrue(all(r["resolvedAddress"] == "Denver" for r in results))
+
+    def test_waiters_call_upstream_if_leader_fails(self):
+        store = LocalStore()
+        provider = CountingProvider()
+        waiter = WeatherService([provider], store=store)
+        lock = 'call-lock:["resolve", "denver"]'
+        results = []
+
+        # another process holds the lock, then dies without a result
+        store.add(lock, 1, 5)
+        t = threading.Thread(target=lambda: results.append(waiter.resolve("Denver")))
+        t.start()
+        time.sleep(0.2)
+        self.assertEqual(provider.calls, 0)
+
+        store.delete(lock)
+        t.join()
+
+        self.assertEqual(provider.calls, 1)
+        self.assertEqual(results[0]["resolvedAddress"], "Denver")
+
+    def test_fixture_not_mixed_with_real_providers(self):
+        app = SimpleNamespace(
+            extensions={}, config={"WEATHER_PROVIDERS": ["visualcrossing", "fixture"]}
+        )
+        with self.assertRaises(ValueError):
+            get_weather_service(app)
+
+        app.config["WEATHER_PROVIDERS"] = ["fixture"]
+        self.assertIsInstance(get_weather_service(app).providers[0], FixtureProvider)
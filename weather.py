@@ -0,0 +1,266 @@
+"""Weather data providers for weather app."""
+
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+from cache import get_store
+
+VISUAL_CROSSING_URL = (
+    "https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline/"
+)
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "timeline.json")
+
+# seconds a shared result is kept for processes waiting on another's call
+SHARED_RESULT_TTL = 5
+SHARED_POLL_INTERVAL = 0.05
+
+
+class WeatherProviderError(Exception):
+    """Raised when no provider could return weather data."""
+
+
+class VisualCrossingProvider:
+    """Weather data from the Visual Crossing timeline API."""
+
+    name = "visualcrossing"
+
+    def __init__(self, api_key, timeout=10):
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def _get(self, path, params):
+        resp = requests.get(
+            f"{VISUAL_CROSSING_URL}{path}",
+            params={**params, "key": self.api_key},
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    def resolve(self, query):
+        """Return dict with resolvedAddress, latitude and longitude for query."""
+
+        return self._get(query, {"include": ""})
+
+    def forecast(self, lat, long):
+        """Return timeline data (days, currentConditions, alerts) for lat/long."""
+
+        return self._get(
+            f"{lat},{long}",
+            {"unitGroup": "us", "include": "days,current,alerts", "contentType": "json"},
+        )
+
+
+class FixtureProvider:
+    """Weather data read from a local JSON file, for offline dev and load tests.
+
+    Searches for a "lat,long" pair resolve to that pair; any other search
+    resolves to a stable made-up coordinate derived from the search text, so
+    different searches still map to different locations.
+    """
+
+    name = "fixture"
+
+    def __init__(self, path=FIXTURE_PATH):
+        self.path = path
+        self._data = None
+
+    def _load(self):
+        if self._data is None:
+            with open(self.path) as f:
+                self._data = json.load(f)
+        return self._data
+
+    def resolve(self, query):
+        try:
+            lat, long = (float(part) for part in query.split(","))
+            address = f"{lat}, {long}"
+        except ValueError:
+            digest = hashlib.sha1(query.strip().lower().encode("utf8")).digest()
+            lat = round(int.from_bytes(digest[:4], "big") / 2**32 * 180 - 90, 4)
+            long = round(int.from_bytes(digest[4:8], "big") / 2**32 * 360 - 180, 4)
+            address = query.strip()
+
+        return {"resolvedAddress": address, "latitude": lat, "longitude": long}
+
+    def forecast(self, lat, long):
+        data = json.loads(json.dumps(self._load()))
+        data["latitude"] = lat
+        data["longitude"] = long
+        return data
+
+
+PROVIDERS = {
+    VisualCrossingProvider.name: lambda config: VisualCrossingProvider(
+        config.get("WEATHER_API_KEY"), config.get("WEATHER_TIMEOUT", 10)
+    ),
+    FixtureProvider.name: lambda config: FixtureProvider(
+        config.get("WEATHER_FIXTURE_PATH", FIXTURE_PATH)
+    ),
+}
+
+
+class WeatherService:
+    """Calls providers in order, hedging slow ones.
+
+    The first provider is called right away. If it hasn't answered within
+    hedge_after seconds (or it fails), the next provider is called too, and
+    whichever answers successfully first wins.
+
+    Concurrent identical requests are coalesced: only the first goes
+    upstream and the rest wait for and share its answer. Threads of one
+    process share a Future. With a shared store (Redis), other processes
+    coalesce too: the first takes a lock key, and the rest wait up to
+    shared_wait seconds for its result key before giving up and calling
+    upstream themselves.
+    """
+
+    def __init__(
+        self, providers, hedge_after=1.5, max_workers=64, store=None, shared_wait=15
+    ):
+        self.providers = providers
+        self.hedge_after = hedge_after
+        self.max_workers = max_workers
+        self.store = store
+        self.shared_wait = shared_wait
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def _call(self, method, *args):
+        pending = {}
+        remaining = list(self.providers)
+        errors = []
+
+        while remaining or pending:
+            if remaining:
+                provider = remaining.pop(0)
+                started = threading.Event()
+                future = self.executor.submit(
+                    _run_started, started, getattr(provider, method), *args
+                )
+                pending[future] = provider
+                if len(pending) == 1:
+                    # time the hedge from when the call starts, not from when
+                    # it was queued, so a busy executor doesn't trigger hedges
+                    started.wait()
+
+            timeout = self.hedge_after if remaining else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    errors.append(f"{provider.name}: {e}")
+
+        raise WeatherProviderError("; ".join(errors) or "no weather providers")
+
+    def _coalesced(self, key, method, *args):
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not leader:
+            # callers may change the data (location_page does), so each gets a copy
+            return copy.deepcopy(future.result())
+
+        try:
+            if self.store is None:
+                result = self._call(method, *args)
+            else:
+                result = self._shared_call(key, method, *args)
+            future.set_result(result)
+            return copy.deepcopy(result)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    def _shared_call(self, key, method, *args):
+        """Coalesce with other processes through the shared store."""
+
+        name = json.dumps(key)
+        lock_key, result_key = f"call-lock:{name}", f"call-result:{name}"
+
+        result = self.store.get(result_key)
+        if result is not None:
+            return result
+
+        if self.store.add(lock_key, 1, self.shared_wait):
+            try:
+                result = self._call(method, *args)
+                self.store.set(result_key, result, SHARED_RESULT_TTL)
+                return result
+            finally:
+                self.store.delete(lock_key)
+
+        deadline = time.monotonic() + self.shared_wait
+        while time.monotonic() < deadline:
+            time.sleep(SHARED_POLL_INTERVAL)
+            result = self.store.get(result_key)
+            if result is not None:
+                return result
+            if self.store.get(lock_key) is None:
+                # the other process failed; try ourselves
+                break
+
+        return self._call(method, *args)
+
+    def resolve(self, query):
+        key = ("resolve", normalize_query(query))
+        return self._coalesced(key, "resolve", query)
+
+    def forecast(self, lat, long):
+        return self._coalesced(("forecast", lat, long), "forecast", lat, long)
+
+
+def _run_started(started, func, *args):
+    started.set()
+    return func(*args)
+
+
+def normalize_query(query):
+    """Searches that only differ in case or spacing are the same search."""
+
+    return " ".join(query.split()).lower()
+
+
+def get_weather_service(app):
+    """Return the app's WeatherService, building it from config on first use."""
+
+    service = app.extensions.get("weather")
+
+    if service is None:
+        names = app.config.get("WEATHER_PROVIDERS", ["visualcrossing"])
+        if FixtureProvider.name in names and len(names) > 1:
+            # the fixture answers instantly with fake data, so it would win
+            # every hedge and its made-up coordinates would be saved
+            raise ValueError("the fixture weather provider can't be mixed with others")
+        providers = [PROVIDERS[name](app.config) for name in names]
+        hedge_after = app.config.get("WEATHER_HEDGE_AFTER", 1.5)
+        service = WeatherService(
+            providers,
+            hedge_after,
+            app.config.get("WEATHER_MAX_WORKERS", 64),
+            # only a store every worker shares can coalesce between workers
+            get_store(app) if app.config.get("REDIS_URL") else None,
+            app.config.get("WEATHER_TIMEOUT", 10) + hedge_after * len(providers),
+        )
+        app.extensions["weather"] = service
+
+    return service